@@ -1,2 +1,3 @@
 from __future__ import absolute_import
 from .pymessagefocus import *
+from .replay import RecordingTransport, ReplayServer, replay
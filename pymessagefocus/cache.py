@@ -0,0 +1,125 @@
+from __future__ import absolute_import
+import copy
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+# Cache backends for MessageFocusClient lookups (email address to
+# contact id) and metadata (get_lists, get_core_tables, get_data_tables).
+# A backend is any object with get(key), set(key, value, ttl) and
+# delete(key), where get returns None for missing or expired keys.
+
+
+class CacheBackend(object):
+    """
+    CacheBackend
+    ------------------------------------------------
+    Interface for MessageFocusClient cache backends.
+    ------------------------------------------------
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """
+    MemoryCache
+    ------------------------------------------------
+    A per process cache held in a dict. Values are
+    copied in and out so callers changing a result they
+    were given cannot change what later calls get.
+    ------------------------------------------------
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        return
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+        return copy.deepcopy(entry[1])
+
+    def set(self, key, value, ttl):
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+        return
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        return
+
+
+class SQLiteCache(CacheBackend):
+    """
+    SQLiteCache
+    ------------------------------------------------
+    A cache shared by every process on a host through a
+    SQLite database in WAL mode, so forked workers warm
+    and read the same entries. Values are pickled, only
+    point it at a file the workers alone can write.
+    Each thread (and forked process) opens its own
+    connection. Expired keys are deleted every
+    purge_every sets.
+    ------------------------------------------------
+    @param  path          str
+    @param  [purge_every] int
+    """
+
+    def __init__(self, path, purge_every=1000):
+        self._path = path
+        self._purge_every = purge_every
+        self._sets = 0
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute('CREATE TABLE IF NOT EXISTS cache ('
+                           'key TEXT PRIMARY KEY, expires REAL NOT NULL, value BLOB NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+        return
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute('SELECT value FROM cache WHERE key = ? AND expires > ?',
+                                         (key, time.time())).fetchone()
+        return pickle.loads(bytes(row[0])) if row else None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO cache (key, expires, value) VALUES (?, ?, ?)',
+                           (key, now + ttl, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))))
+        self._sets += 1
+        if not self._sets % self._purge_every:
+            connection.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+        return
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+        return
@@ -0,0 +1,135 @@
+from __future__ import absolute_import
+import hashlib
+import json
+import shelve
+import threading
+
+import six
+
+
+# Fingerprint stores remember, per core table and email address, a short
+# hash of every field last sent with contact.create along with the
+# contact id and the list ids it was associated with. MessageFocusClient
+# uses them to skip contact.create calls that would not change anything
+# and to send only the fields that did change.
+#
+# Entries look like {
+#     'contact_id': int,
+#     'fields':     {field_name: str},
+#     'lists':      [int]
+# }
+
+
+def fingerprint_key(core_table_id, email):
+    """
+    fingerprint_key
+    ------------------------------------------------
+    Build the store key for a contact.
+    ------------------------------------------------
+    @param  core_table_id int
+    @param  email         str
+    @return               str
+    """
+    return '%s:%s' % (core_table_id, email.strip().lower())
+
+
+def fingerprint_fields(contact_data):
+    """
+    fingerprint_fields
+    ------------------------------------------------
+    Hash each field of already cleaned contact data.
+    @see(MessageFocusClient.clean_contact_data)
+    The hash only needs to detect changes, it is not
+    meant to be collision resistant.
+    ------------------------------------------------
+    @param  contact_data dict
+    @return              dict {field_name: str}
+    """
+    fields = {}
+    for field_name, field_value in contact_data.items():
+        encoded = json.dumps(field_value, sort_keys=True, default=six.text_type)
+        fields[field_name] = hashlib.md5(encoded.encode('utf-8')).hexdigest()[:16]
+    return fields
+
+
+class MemoryFingerprintStore(object):
+    """
+    MemoryFingerprintStore
+    ------------------------------------------------
+    Keep fingerprints in a dict for the lifetime of the
+    process.
+    ------------------------------------------------
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        return
+
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+        return
+
+    def forget(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        return
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return
+
+
+class ShelveFingerprintStore(object):
+    """
+    ShelveFingerprintStore
+    ------------------------------------------------
+    Keep fingerprints on disk with the shelve module so
+    they survive between sync job runs. Only one process
+    should have the file open at a time. Call close()
+    when done to make sure everything is written.
+    ------------------------------------------------
+    @param  path str
+    """
+
+    def __init__(self, path):
+        self._shelf = shelve.open(path)
+        self._lock = threading.Lock()
+        return
+
+    def get(self, key):
+        with self._lock:
+            return self._shelf.get(key)
+
+    def set(self, key, entry):
+        with self._lock:
+            self._shelf[key] = entry
+        return
+
+    def forget(self, key):
+        with self._lock:
+            self._shelf.pop(key, None)
+        return
+
+    def clear(self):
+        # Delete by key, Shelf.clear() would unpickle every entry.
+        with self._lock:
+            for key in list(self._shelf.keys()):
+                del self._shelf[key]
+        return
+
+    def sync(self):
+        with self._lock:
+            self._shelf.sync()
+        return
+
+    def close(self):
+        with self._lock:
+            self._shelf.close()
+        return
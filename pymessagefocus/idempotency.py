@@ -0,0 +1,233 @@
+from __future__ import absolute_import
+import collections
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import six
+
+logger = logging.getLogger(__name__)
+
+# Idempotency stores remember the result of a successful transactional
+# send for a fixed time window so that retries and duplicate upstream
+# events inside the window return the original result instead of
+# sending the email again. Failed sends are never stored.
+#
+# A send first claims its key, which atomically either returns the
+# result already stored for it, PENDING while another caller is still
+# sending it, or None after reserving the key for this caller. The
+# caller then stores the result with set() or gives the key back with
+# release() if the send failed. Reservations expire after
+# pending_timeout seconds in case the caller dies mid-send.
+
+PENDING = object()
+
+
+def idempotency_key(core_table_id, campaign_id, contact_id, launch_reference=None, transaction_data=None):
+    """
+    idempotency_key
+    ------------------------------------------------
+    Build the store key for a transactional send from
+    the contact id it goes to (looked up first when the
+    caller gave an email address) and a hash of its
+    (cleaned) transaction data, so that different
+    receipts to the same contact are never mistaken for
+    duplicates.
+    ------------------------------------------------
+    @param  core_table_id      int
+    @param  campaign_id        int
+    @param  contact_id         int
+    @param  [launch_reference] int or str
+    @param  [transaction_data] dict
+    @return                    str
+    """
+    data_hash = ''
+    if transaction_data:
+        encoded = json.dumps(transaction_data, sort_keys=True, default=six.text_type)
+        data_hash = hashlib.md5(encoded.encode('utf-8')).hexdigest()
+    return '%s|%s|%s|%s|%s' % (core_table_id, campaign_id, contact_id, launch_reference or '', data_hash)
+
+
+class MemoryIdempotencyStore(object):
+    """
+    MemoryIdempotencyStore
+    ------------------------------------------------
+    Keep results in insertion order so expired keys can
+    be dropped from the front without scanning, and cap
+    the number of keys held at once. By default the cap
+    allows 1000 sends a second over the whole window.
+    Going over it evicts the oldest keys while still in
+    the window, letting their duplicates through, so
+    evictions are counted in stats() and logged.
+    ------------------------------------------------
+    @param  [window]          float seconds
+    @param  [max_keys]        int
+    @param  [pending_timeout] float seconds
+    """
+
+    def __init__(self, window=300, max_keys=None, pending_timeout=60):
+        self._window = window
+        self._max_keys = max_keys or max(1000, int(window * 1000))
+        self._pending_timeout = pending_timeout
+        self._entries = collections.OrderedDict()
+        self._evicted = 0
+        self._lock = threading.Lock()
+        return
+
+    def _expire(self, now):
+        while self._entries:
+            key, (expires, result) = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            del self._entries[key]
+        return
+
+    def _put(self, key, expires, result, now):
+        # Called with the lock held.
+        self._entries.pop(key, None)
+        self._entries[key] = (expires, result)
+        self._expire(now)
+        while len(self._entries) > self._max_keys:
+            self._entries.popitem(last=False)
+            if not self._evicted % self._max_keys:
+                logger.warning('Idempotency store is over max_keys (%s), evicting keys inside the window',
+                               self._max_keys)
+            self._evicted += 1
+        return
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+        if not entry or entry[0] <= now or entry[1] is PENDING:
+            return None
+        return entry[1]
+
+    def claim(self, key):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+            self._put(key, now + self._pending_timeout, PENDING, now)
+        return None
+
+    def set(self, key, result):
+        now = time.time()
+        with self._lock:
+            self._put(key, now + self._window, result, now)
+        return
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] is PENDING:
+                del self._entries[key]
+        return
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return
+
+    def stats(self):
+        """
+        MemoryIdempotencyStore.stats
+        ------------------------------------------------
+        Return a dict like {
+            'keys':     int, held now
+            'max_keys': int,
+            'evicted':  int, keys evicted inside the window
+        }
+        ------------------------------------------------
+        @return dict
+        """
+        with self._lock:
+            return {'keys': len(self._entries),
+                    'max_keys': self._max_keys,
+                    'evicted': self._evicted}
+
+
+class SQLiteIdempotencyStore(object):
+    """
+    SQLiteIdempotencyStore
+    ------------------------------------------------
+    Share the idempotency window between processes on a
+    host through a SQLite database in WAL mode. Each
+    thread (and forked process) opens its own connection.
+    Expired keys are deleted every purge_every sets.
+    Pending reservations are stored with an empty result.
+    ------------------------------------------------
+    @param  path              str
+    @param  [window]          float seconds
+    @param  [purge_every]     int
+    @param  [pending_timeout] float seconds
+    """
+
+    def __init__(self, path, window=300, purge_every=1000, pending_timeout=60):
+        self._path = path
+        self._window = window
+        self._pending_timeout = pending_timeout
+        self._purge_every = purge_every
+        self._sets = 0
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute('CREATE TABLE IF NOT EXISTS idempotency ('
+                           'key TEXT PRIMARY KEY, expires REAL NOT NULL, result TEXT NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS idempotency_expires ON idempotency (expires)')
+        return
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute('SELECT result FROM idempotency WHERE key = ? AND expires > ?',
+                                         (key, time.time())).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def claim(self, key):
+        now = time.time()
+        connection = self._connection()
+        # Drop an expired row first so that INSERT OR IGNORE only fails
+        # when another caller holds a live row for the key.
+        connection.execute('DELETE FROM idempotency WHERE key = ? AND expires <= ?', (key, now))
+        cursor = connection.execute('INSERT OR IGNORE INTO idempotency (key, expires, result) VALUES (?, ?, ?)',
+                                    (key, now + self._pending_timeout, ''))
+        if cursor.rowcount == 1:
+            return None
+        row = connection.execute('SELECT result FROM idempotency WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            # The other caller released it in the meantime, try again.
+            return self.claim(key)
+        return json.loads(row[0]) if row[0] else PENDING
+
+    def set(self, key, result):
+        now = time.time()
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO idempotency (key, expires, result) VALUES (?, ?, ?)',
+                           (key, now + self._window, json.dumps(result, default=str)))
+        self._sets += 1
+        if not self._sets % self._purge_every:
+            connection.execute('DELETE FROM idempotency WHERE expires <= ?', (now,))
+        return
+
+    def release(self, key):
+        self._connection().execute("DELETE FROM idempotency WHERE key = ? AND result = ''", (key,))
+        return
+
+    def clear(self):
+        self._connection().execute('DELETE FROM idempotency')
+        return
@@ -1,10 +1,17 @@
+import logging
 import re
 import xmlrpc.client as xmlrpclib
 
 import six
 from future.builtins import range
 
+from .fingerprint import fingerprint_key, fingerprint_fields
+from .idempotency import PENDING, idempotency_key
+from .scheduler import priority, scheduled
+from .tracing import SamplingProfiler, timed, traced
+from .transport import MessageFocusTransport, ServerProxy
 
+logger = logging.getLogger(__name__)
 # See: https://docs.python.org/2/library/xmlrpclib.html
 # See: http://pymotw.com/2/xmlrpclib/
 
@@ -68,6 +75,8 @@ class MessageFocusClient(object):
                    '4499': 'Missing necessary input parameters. %s.',
                        # Action required in MessageFocus
                    '4501': 'Campaign has not been published. %s.',
+                       # Idempotency 4600+
+                   '4601': 'The same transactional send is already in progress. %s.',
                        # xmlrpclib errors
                    '5101': 'Not authenticated. %s.',
                    '5102': 'Cannot pass None values unless enabled in xmlrpclib.'}
@@ -81,13 +90,205 @@ class MessageFocusClient(object):
         PERMISSION_OBJECT_ID = re.compile('object_id=([0-9]+)')
         CAMPAIGN_ID_FROM_ADDITIONAL = re.compile('campaign id: ([^,]+),')
 
-    def __init__(self, organisation, username, password):
+    def __init__(self, organisation, username, password, transport=None, url=None, fingerprint_store=None,
+                 idempotency_store=None, tracer=None, cache=None, cache_ttl=300, scheduler=None):
         self._organisation = organisation
         self._username = username
         self._password = password
 
-        self._url = 'https://%s.%s:%s@app.adestra.com/api/xmlrpc'
-        self._api = xmlrpclib.ServerProxy(self._url % (organisation, username, password), encoding="UTF-8")
+        # Optional store used to skip contact.create calls that would
+        # not change anything. @see(pymessagefocus.fingerprint)
+        self._fingerprints = fingerprint_store
+
+        # Optional store of recent successful transactional sends used to
+        # drop duplicates. @see(pymessagefocus.idempotency)
+        self._idempotency = idempotency_store
+
+        # The url is a template filled with organisation, username and
+        # password, overridable to point the client at a stand-in server.
+        # @see(pymessagefocus.replay.ReplayServer)
+        self._url = url or 'https://%s.%s:%s@app.adestra.com/api/xmlrpc'
+        if transport is None:
+            transport = MessageFocusTransport(secure=self._url.startswith('https'))
+        self._api = ServerProxy(self._url % (organisation, username, password),
+                                transport=transport,
+                                encoding="UTF-8")
+
+        # Optional callable receiving a span per call, and an optional
+        # profiler for sampled calls. @see(pymessagefocus.tracing)
+        self._tracer = tracer
+        self._profiler = None
+
+        # Optional cache backend for contact id lookups and list / table
+        # metadata, e.g. shared between worker processes.
+        # @see(pymessagefocus.cache)
+        self._cache = cache
+        self._cache_ttl = cache_ttl
+
+        # Optional scheduler sharing a concurrency budget between
+        # transactional and bulk calls. @see(pymessagefocus.scheduler)
+        self._scheduler = scheduler
+        return
+
+    # The fingerprint store only saves API calls, failing to read it is
+    # treated as a miss and failing to write it must not fail the call
+    # that has already succeeded.
+
+    def _get_fingerprint(self, key):
+        try:
+            return self._fingerprints.get(key)
+        except Exception:
+            logger.exception('Could not read fingerprint for %s', key)
+            return None
+
+    def _set_fingerprint(self, key, entry):
+        try:
+            self._fingerprints.set(key, entry)
+        except Exception:
+            logger.exception('Could not store fingerprint for %s', key)
+        return
+
+    def _cache_key(self, *parts):
+        # Namespace keys by organisation as a cache may be shared
+        # between clients for different accounts.
+        return ':'.join([six.text_type(self._organisation)] + [six.text_type(part) for part in parts])
+
+    # The cache is only an optimisation, backend errors are logged and
+    # treated as a miss or a no-op so they never change an API result.
+
+    def _cache_get(self, *parts):
+        if self._cache is None:
+            return None
+        key = self._cache_key(*parts)
+        try:
+            return self._cache.get(key)
+        except Exception:
+            logger.exception('Could not read %s from the cache', key)
+            return None
+
+    def _cache_set(self, value, *parts):
+        if self._cache is None:
+            return
+        key = self._cache_key(*parts)
+        try:
+            self._cache.set(key, value, self._cache_ttl)
+        except Exception:
+            logger.exception('Could not write %s to the cache', key)
+        return
+
+    def warm_up(self, connections=1):
+        """
+        MessageFocusClient.warm_up
+        ------------------------------------------------
+        Resolve the MessageFocus host and open connections
+        (including the TLS handshake) ahead of the first
+        call so that it does not pay for them. Later
+        connections resume the TLS session.
+        On success returns a dict like {
+            'success': True,
+            'results': [@see(MessageFocusClient.connection_stats)]
+        }
+        If an error was encountered it returns a dict s.t. {
+            'success': False,
+            'results': [@see(MessageFocusClient.parse_exception)]
+        }
+        ------------------------------------------------
+        @param  [connections] int
+        @return               dict {
+            'success': bool,
+            'results': list
+        }
+        """
+        if not hasattr(self._api('transport'), 'warm_up'):
+            return {'success': True, 'results': [{}]}
+        try:
+            return {'success': True, 'results': [self._api.warm_up(connections)]}
+        except Exception as e:
+            return {'success': False, 'results': [self.parse_exception(e)]}
+        pass
+
+    def connection_stats(self):
+        """
+        MessageFocusClient.connection_stats
+        ------------------------------------------------
+        DNS lookup, connection and TLS handshake counts and
+        handshake durations for the client's transport, or
+        an empty dict if the transport does not keep them.
+        @see(pymessagefocus.transport.MessageFocusTransport.connection_stats)
+        ------------------------------------------------
+        @return dict
+        """
+        transport = self._api('transport')
+        if not hasattr(transport, 'connection_stats'):
+            return {}
+        return transport.connection_stats()
+
+    def priority(self, priority_class):
+        """
+        MessageFocusClient.priority
+        ------------------------------------------------
+        Context manager overriding the scheduler priority
+        class ('transactional', 'default' or 'bulk' unless
+        the scheduler has other weights) of calls made
+        inside it on this thread. Raises ValueError on entry
+        for an unknown class.
+        @see(pymessagefocus.scheduler)
+        ------------------------------------------------
+        @param  priority_class str
+        """
+        return priority(priority_class, self._scheduler)
+
+    def scheduler_stats(self):
+        """
+        MessageFocusClient.scheduler_stats
+        ------------------------------------------------
+        Queue depth and wait time per priority class, or an
+        empty dict without a scheduler.
+        @see(pymessagefocus.scheduler.Scheduler.stats)
+        ------------------------------------------------
+        @return dict
+        """
+        if self._scheduler is None:
+            return {}
+        return self._scheduler.stats()
+
+    def set_tracer(self, tracer):
+        """
+        MessageFocusClient.set_tracer
+        ------------------------------------------------
+        Set or, with None, remove the callable receiving a
+        span for every client method call.
+        @see(pymessagefocus.tracing)
+        ------------------------------------------------
+        @param  tracer callable or None
+        """
+        self._tracer = tracer
+        return
+
+    def enable_profiling(self, mode='cprofile', every=100):
+        """
+        MessageFocusClient.enable_profiling
+        ------------------------------------------------
+        Profile one in every N traced calls with cProfile
+        or tracemalloc, attaching the output to the span.
+        Only has an effect while a tracer is set.
+        ------------------------------------------------
+        @param  [mode]  str 'cprofile' or 'tracemalloc'
+        @param  [every] int
+        """
+        self._profiler = SamplingProfiler(mode=mode, every=every)
+        return
+
+    def disable_profiling(self):
+        """
+        MessageFocusClient.disable_profiling
+        ------------------------------------------------
+        Stop profiling traced calls, the tracer still
+        receives their spans.
+        @see(MessageFocusClient.enable_profiling)
+        ------------------------------------------------
+        """
+        self._profiler = None
         return
 
     def error_dictionary(self, error_code, additional_information=None):
@@ -114,6 +315,7 @@ class MessageFocusClient(object):
             error_string = 'unknown error code'
         return {'message': error_string, 'code': error_code}
 
+    @timed('parse_exception')
     def parse_exception(self, exception, additional_information=None, request_xml=None):
         """
         MessageFocusClient.parse_exception
@@ -273,6 +475,8 @@ class MessageFocusClient(object):
 
         return filter_each(results, filter_dictionary, None)
 
+    @traced
+    @scheduled
     def _add_contact_to_core_table(self, core_table_id, contact_data):
         """
         MessageFocusClient._add_contact_to_core_table
@@ -280,9 +484,12 @@ class MessageFocusClient(object):
         Add contact to core table and optionally data tables.
         To provide data for data tables, prefix the field
         name with the data table id, e.g. "2.field_name".
+        With a fingerprint store only changed fields are
+        sent ('Updated') and unchanged contacts are not sent
+        at all ('Unchanged').
         If successful this method returns a dict s.t. {
             'success': True,
-            'results': [{'message': 'Added',
+            'results': [{'message': 'Added' or 'Updated' or 'Unchanged',
                          'contact_id': contact_id}]
         }
         If an error was encountered it returns a dict s.t. {
@@ -317,14 +524,43 @@ class MessageFocusClient(object):
         # Clean contact data for passing via XML, including removing None values and substituting for pound characters
         contact_data = self.clean_contact_data(contact_data)
 
+        message = 'Added'
+        if self._fingerprints is not None:
+            key = fingerprint_key(core_table_id, email)
+            fields = fingerprint_fields(contact_data)
+            entry = self._get_fingerprint(key)
+            if entry:
+                changed = [field_name for field_name in fields
+                           if entry['fields'].get(field_name) != fields[field_name]]
+                if not changed:
+                    return {'success': True, 'results': [{'message': 'Unchanged', 'contact_id': entry['contact_id']}]}
+                # Only send what changed, the email field identifies the contact.
+                contact_data = dict((field_name, contact_data[field_name]) for field_name in changed)
+                contact_data['email'] = email
+                message = 'Updated'
+                pass
+
         try:
-            return {'success': True, 'results': [{'message': 'Added', 'contact_id': self._api.contact.create(core_table_id, contact_data)}]}
+            contact_id = self._api.contact.create(core_table_id, contact_data)
         except Exception as e:
             additional_information = u'Core table id: %s, contact data: %s' % (core_table_id, contact_data)
             result = self.parse_exception(e, additional_information=contact_data, request_xml=xmlrpclib.dumps((core_table_id, contact_data), "contact.create"))
             return {'success': False, 'results': [result]}
-        pass
 
+        if self._fingerprints is not None:
+            # Build a new entry rather than changing the stored one in place,
+            # other threads may be reading it.
+            updated = {'contact_id': contact_id,
+                       'fields': dict(entry['fields']) if entry else {},
+                       'lists': list(entry['lists']) if entry else []}
+            updated['fields'].update(fields)
+            self._set_fingerprint(key, updated)
+            pass
+        self._cache_set(contact_id, 'contact_id', core_table_id, email.strip().lower())
+        return {'success': True, 'results': [{'message': message, 'contact_id': contact_id}]}
+
+    @traced
+    @scheduled
     def _associate_contact_with_list(self, contact_id, list_id):
         """
         MessageFocusClient._associate_contact_with_list
@@ -374,6 +610,8 @@ class MessageFocusClient(object):
             return {'success': False, 'results': [result]}
         pass
 
+    @traced
+    @scheduled
     def add_contact_to_list(self, core_table_id, list_id, contact_data):
         """
         MessageFocusClient.add_contact_to_list
@@ -398,12 +636,31 @@ class MessageFocusClient(object):
         core_table_result = self._add_contact_to_core_table(core_table_id, contact_data)
 
         if core_table_result.get('success') and len(core_table_result.get('results', [])):
-            # The below call will return success with different string values in the
-            # results list depending on if there already was an association or if a
-            # new one was added. @see(MessageFocusClient._associate_contact_with_list)
-            return self._associate_contact_with_list(core_table_result.get('results')[0].get('contact_id'), list_id)
+            contact_id = core_table_result.get('results')[0].get('contact_id')
+            if self._fingerprints is None:
+                # The below call will return success with different string values in the
+                # results list depending on if there already was an association or if a
+                # new one was added. @see(MessageFocusClient._associate_contact_with_list)
+                return self._associate_contact_with_list(contact_id, list_id)
+
+            # With a fingerprint store, skip the association when this contact
+            # was already associated with the list by an earlier call.
+            key = fingerprint_key(core_table_id, contact_data['email'])
+            entry = self._get_fingerprint(key)
+            if entry and list_id in entry['lists']:
+                return {'success': True,
+                        'results': [{'message': 'Already associated', 'contact_id': contact_id}]}
+            result = self._associate_contact_with_list(contact_id, list_id)
+            if entry and result.get('success'):
+                updated = dict(entry)
+                updated['lists'] = list(entry['lists']) + [list_id]
+                self._set_fingerprint(key, updated)
+                pass
+            return result
         return core_table_result
 
+    @traced
+    @scheduled
     def add_contacts_to_list(self, core_table_id, list_id, data_file_url, csv_column_map, notification_email_address=None):
         """
         MessageFocusClient.add_contacts_to_list
@@ -472,6 +729,8 @@ class MessageFocusClient(object):
                     'results': [self.parse_exception(e, additional_information=additional_information)]}
         pass
 
+    @traced
+    @scheduled
     def get_core_data_for_contact_id(self, contact_id):
         """
         MessageFocusClient.get_core_data_for_contact_id
@@ -510,6 +769,92 @@ class MessageFocusClient(object):
                     'results': [self.parse_exception(e, additional_information=additional_information)]}
         pass
 
+    def _multicall_for_contact_ids(self, method_name, contact_ids, chunk_size):
+        """
+        MessageFocusClient._multicall_for_contact_ids
+        ------------------------------------------------
+        Call method_name once per contact id, batching the
+        calls into system.multicall requests of chunk_size
+        calls each. Returns a dict keyed by contact id with
+        a result dict per id in the format of the single
+        id methods. A failed multicall request fails every
+        id in its chunk, as does an invalid chunk_size every
+        id. Unhashable ids are keyed by their repr().
+        ------------------------------------------------
+        @param  method_name str e.g. 'contact.get'
+        @param  contact_ids list
+        @param  chunk_size  int
+        @return             dict {contact_id: dict {
+            'success': bool,
+            'results': list
+        }}
+        """
+        results = {}
+        valid_ids = []
+        seen_ids = set()
+        for contact_id in contact_ids:
+            if not isinstance(contact_id, int):
+                additional_information = 'Input value: %s %s' % (contact_id, type(contact_id))
+                try:
+                    hash(contact_id)
+                except TypeError:
+                    contact_id = repr(contact_id)
+                results[contact_id] = {'success': False,
+                                       'results': [self.error_dictionary(4403, additional_information=additional_information)]}
+            elif contact_id not in seen_ids:
+                seen_ids.add(contact_id)
+                valid_ids.append(contact_id)
+
+        if not isinstance(chunk_size, int) or chunk_size < 1:
+            additional_information = 'Input value: chunk_size %s %s' % (chunk_size, type(chunk_size))
+            for contact_id in valid_ids:
+                results[contact_id] = {'success': False,
+                                       'results': [self.error_dictionary(4403, additional_information=additional_information)]}
+            return results
+
+        for start in range(0, len(valid_ids), chunk_size):
+            chunk = valid_ids[start:start + chunk_size]
+            multicall = xmlrpclib.MultiCall(self._api)
+            for contact_id in chunk:
+                getattr(multicall, method_name)(contact_id)
+            try:
+                responses = multicall()
+            except Exception as e:
+                for contact_id in chunk:
+                    additional_information = 'Contact id: %s' % contact_id
+                    results[contact_id] = {'success': False,
+                                           'results': [self.parse_exception(e, additional_information=additional_information)]}
+                continue
+
+            for index, contact_id in enumerate(chunk):
+                try:
+                    results[contact_id] = {'success': True, 'results': [responses[index]]}
+                except Exception as e:
+                    additional_information = 'Contact id: %s' % contact_id
+                    results[contact_id] = {'success': False,
+                                           'results': [self.parse_exception(e, additional_information=additional_information)]}
+        return results
+
+    @traced
+    @scheduled
+    def get_core_data_for_contact_ids(self, contact_ids, chunk_size=100):
+        """
+        MessageFocusClient.get_core_data_for_contact_ids
+        ------------------------------------------------
+        Fetch core table data for many contact ids, batched
+        into system.multicall requests of chunk_size ids.
+        Returns a dict keyed by contact id like {
+            contact_id: @see(MessageFocusClient.get_core_data_for_contact_id)
+        }
+        ------------------------------------------------
+        @param  contact_ids  list
+        @param  [chunk_size] int
+        @return              dict
+        """
+        return self._multicall_for_contact_ids('contact.get', contact_ids, chunk_size)
+
+    @traced
+    @scheduled
     def get_core_data_for_email_address(self, core_table_id, email_address):
         """
         MessageFocusClient.get_core_data_for_email_address
@@ -553,6 +898,7 @@ class MessageFocusClient(object):
                 additional_information = 'Email address: %s' % email_address
                 return {'success': False,
                         'results': [self.error_dictionary(207, additional_information=additional_information)]}
+            self._cache_set(result[0].get('id'), 'contact_id', core_table_id, email_address.strip().lower())
             return {'success': True, 'results': result}
         except Exception as e:
             additional_information = 'Core table id: %s, email address: %s' % (core_table_id, email_address)
@@ -560,6 +906,8 @@ class MessageFocusClient(object):
                     'results': [self.parse_exception(e, additional_information=additional_information)]}
         pass
 
+    @traced
+    @scheduled
     def get_lists_for_contact_id(self, contact_id):
         """
         MessageFocusClient.get_lists_for_contact_id
@@ -595,6 +943,26 @@ class MessageFocusClient(object):
                     'results': [self.parse_exception(e, additional_information=additional_information)]}
         pass
 
+    @traced
+    @scheduled
+    def get_lists_for_contact_ids(self, contact_ids, chunk_size=100):
+        """
+        MessageFocusClient.get_lists_for_contact_ids
+        ------------------------------------------------
+        Fetch the list ids for many contact ids, batched
+        into system.multicall requests of chunk_size ids.
+        Returns a dict keyed by contact id like {
+            contact_id: @see(MessageFocusClient.get_lists_for_contact_id)
+        }
+        ------------------------------------------------
+        @param  contact_ids  list
+        @param  [chunk_size] int
+        @return              dict
+        """
+        return self._multicall_for_contact_ids('contact.lists', contact_ids, chunk_size)
+
+    @traced
+    @scheduled
     def get_lists_for_email_address(self, core_table_id, email_address):
         """
         MessageFocusClient.get_lists_for_email_address
@@ -630,19 +998,25 @@ class MessageFocusClient(object):
                     'results': [self.error_dictionary(4404, additional_information=additional_information)]}
 
         try:
-            result = self._api.contact.search(core_table_id, {'email': email_address})
-            if not len(result):
-                additional_information = 'Email address: %s' % email_address
-                return {'success': False,
-                        'results': [self.error_dictionary(207, additional_information=additional_information)]}
+            contact_id = self._cache_get('contact_id', core_table_id, email_address.strip().lower())
+            if contact_id is None:
+                result = self._api.contact.search(core_table_id, {'email': email_address})
+                if not len(result):
+                    additional_information = 'Email address: %s' % email_address
+                    return {'success': False,
+                            'results': [self.error_dictionary(207, additional_information=additional_information)]}
+                contact_id = result[0].get("id")
+                self._cache_set(contact_id, 'contact_id', core_table_id, email_address.strip().lower())
 
-            return {'success': True, 'results': self._api.contact.lists(result[0].get("id"))}
+            return {'success': True, 'results': self._api.contact.lists(contact_id)}
         except Exception as e:
             additional_information = 'Core table id: %s, email address: %s' % (core_table_id, email_address)
             return {'success': False,
                     'results': [self.parse_exception(e, additional_information=additional_information)]}
         pass
 
+    @traced
+    @scheduled
     def get_core_tables(self):
         """
         MessageFocusClient.get_core_tables
@@ -662,14 +1036,21 @@ class MessageFocusClient(object):
             'results': list
         }
         """
+        result = self._cache_get('get_core_tables')
+        if result is not None:
+            return result
         try:
-            return {'success': True,
-                    'results': self.filter_results(self._api.coreTable.all(),
-                                                   MessageFocusClient.Filters.TABLE_FILTER)}
+            result = {'success': True,
+                      'results': self.filter_results(self._api.coreTable.all(),
+                                                     MessageFocusClient.Filters.TABLE_FILTER)}
+            self._cache_set(result, 'get_core_tables')
+            return result
         except Exception as e:
             return {'success': False, 'results': [self.parse_exception(e)]}
         pass
 
+    @traced
+    @scheduled
     def get_data_tables(self):
         """
         MessageFocusClient.get_data_tables
@@ -689,14 +1070,21 @@ class MessageFocusClient(object):
             'results': list
         }
         """
+        result = self._cache_get('get_data_tables')
+        if result is not None:
+            return result
         try:
-            return {'success': True,
-                    'results': self.filter_results(self._api.dataTable.all(),
-                                                   MessageFocusClient.Filters.TABLE_FILTER)}
+            result = {'success': True,
+                      'results': self.filter_results(self._api.dataTable.all(),
+                                                     MessageFocusClient.Filters.TABLE_FILTER)}
+            self._cache_set(result, 'get_data_tables')
+            return result
         except Exception as e:
             return {'success': False, 'results': [self.parse_exception(e)]}
         pass
 
+    @traced
+    @scheduled
     def get_lists(self):
         """
         MessageFocusClient.get_lists
@@ -716,20 +1104,35 @@ class MessageFocusClient(object):
             'results': list
         }
         """
+        result = self._cache_get('get_lists')
+        if result is not None:
+            return result
         try:
-            return {'success': True,
-                    'results': self.filter_results(self._api.list.all(),
-                                                   MessageFocusClient.Filters.TABLE_FILTER)}
+            result = {'success': True,
+                      'results': self.filter_results(self._api.list.all(),
+                                                     MessageFocusClient.Filters.TABLE_FILTER)}
+            self._cache_set(result, 'get_lists')
+            return result
         except Exception as e:
             return {'success': False, 'results': [self.parse_exception(e)]}
         pass
 
+    @traced
+    @scheduled
     def transactional(self, core_table_id, campaign_id, contact_id=None, email_address=None, transaction_data={}, launch_reference={}):
         """
         MessageFocusClient.transactional
         ------------------------------------------------
         Send a transactional email (campaign to a single
         email address).
+        With an idempotency store a repeated send for the
+        same contact, campaign, launch reference and
+        transaction data inside the store's window returns
+        the original result without calling MessageFocus,
+        or error 4601 while the first send is in progress.
+        Contacts given by email address are looked up first
+        so that duplicates are found whether the contact is
+        given by id or email address.
         If successful returns a dictionary like {
             'success': True,
             'results': {
@@ -762,11 +1165,88 @@ class MessageFocusClient(object):
             return {'success': False,
                     'results': [self.error_dictionary(4499, additional_information=additional_information)]}
 
+        if self._idempotency is None:
+            return self._transactional(core_table_id, campaign_id, contact_id, email_address,
+                                       transaction_data, launch_reference)
+
+        contact = self._contact_id_for_transactional(core_table_id, contact_id, email_address)
+        if not contact.get('success'):
+            return contact
+        contact_id = contact['results'][0]
+        try:
+            key = idempotency_key(core_table_id, campaign_id, contact_id, launch_reference,
+                                  self.clean_contact_data(transaction_data))
+        except Exception:
+            # Transaction data that cannot be cleaned fails the send before
+            # it reaches MessageFocus, report it as without a store.
+            return self._transactional(core_table_id, campaign_id, contact_id, email_address,
+                                       transaction_data, launch_reference)
+        try:
+            result = self._idempotency.claim(key)
+        except Exception:
+            # Without the store we cannot tell duplicates apart, send anyway.
+            logger.exception('Could not claim idempotency key %s', key)
+            return self._transactional(core_table_id, campaign_id, contact_id, email_address,
+                                       transaction_data, launch_reference)
+        if result is PENDING:
+            additional_information = 'Core table id: %s, campaign id: %s' % (core_table_id, campaign_id)
+            return {'success': False,
+                    'results': [self.error_dictionary(4601, additional_information=additional_information)]}
+        if result is not None:
+            return result
+
+        result = self._transactional(core_table_id, campaign_id, contact_id, email_address,
+                                     transaction_data, launch_reference)
+        # The send result is returned whatever happens to the store, so a
+        # caller never retries an email that has already gone out.
+        try:
+            if result.get('success'):
+                self._idempotency.set(key, result)
+            else:
+                self._idempotency.release(key)
+        except Exception:
+            logger.exception('Could not store idempotency key %s', key)
+        return result
+
+    def _contact_id_for_transactional(self, core_table_id, contact_id, email_address):
+        """
+        MessageFocusClient._contact_id_for_transactional
+        ------------------------------------------------
+        Return contact_id, or look it up by email address
+        when it is not given, like {
+            'success': True,
+            'results': [23]
+        }
+        or the failed lookup.
+        @see(MessageFocusClient.get_core_data_for_email_address)
+        ------------------------------------------------
+        @param  core_table_id int
+        @param  contact_id    int
+        @param  email_address str
+        @return               dict
+        """
+        if email_address and (not contact_id) and isinstance(email_address, six.string_types):
+            contact_id = self._cache_get('contact_id', core_table_id, email_address.strip().lower())
+
         if email_address and (not contact_id):
             core_data = self.get_core_data_for_email_address(core_table_id, email_address)
             if not core_data.get('success'):
                 return core_data
             contact_id = core_data.get('results')[0].get('id')
+        return {'success': True, 'results': [contact_id]}
+
+    def _transactional(self, core_table_id, campaign_id, contact_id, email_address, transaction_data, launch_reference):
+        """
+        MessageFocusClient._transactional
+        ------------------------------------------------
+        Look up the contact if needed and send, without the
+        idempotency store. @see(MessageFocusClient.transactional)
+        ------------------------------------------------
+        """
+        contact = self._contact_id_for_transactional(core_table_id, contact_id, email_address)
+        if not contact.get('success'):
+            return contact
+        contact_id = contact['results'][0]
 
         if launch_reference:
             if (isinstance(launch_reference, int) or isinstance(launch_reference, str)):
@@ -808,6 +1288,7 @@ class MessageFocusClient(object):
         pass
 
 
+    @timed('clean_contact_data')
     def clean_contact_data( self, contact_data ):
         """
         Clean contact data for passing via XML, including removing None values and substituting for pound characters
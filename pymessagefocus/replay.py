@@ -0,0 +1,294 @@
+from __future__ import absolute_import
+import gzip
+import json
+import re
+import threading
+import time
+import socketserver
+import xmlrpc.client as xmlrpclib
+import xmlrpc.server as xmlrpcserver
+
+from future.builtins import range
+
+from .pymessagefocus import MessageFocusClient
+from .transport import MessageFocusTransport
+
+
+# Record MessageFocus XML-RPC traffic to a gzipped JSON lines file and
+# replay it against a local stand-in server for offline load testing.
+#
+# Each recorded line looks like {
+#     't':        float, seconds since the first recorded call
+#     'host':     str,   host with credentials removed
+#     'handler':  str,
+#     'method':   str,   e.g. 'contact.transactional'
+#     'request':  str,   request XML
+#     'response': str,   response XML (result or fault)
+# }
+
+METHOD_NAME = re.compile(r'<methodName>([^<]+)</methodName>')
+
+
+def redact_host(host):
+    """
+    redact_host
+    ------------------------------------------------
+    Strip the "organisation.username:password@" part
+    from an XML-RPC host descriptor.
+    ------------------------------------------------
+    @param  host str or tuple
+    @return      str
+    """
+    if isinstance(host, tuple):
+        host = host[0]
+    return host.rpartition('@')[2]
+
+
+def load_recording(path):
+    """
+    load_recording
+    ------------------------------------------------
+    Read every entry from a recording written by
+    RecordingTransport, in recorded order.
+    ------------------------------------------------
+    @param  path str
+    @return      list
+    """
+    entries = []
+    with gzip.open(path, 'rb') as recording:
+        for line in recording:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line.decode('utf-8')))
+    return entries
+
+
+class RecordingTransport(MessageFocusTransport):
+    """
+    RecordingTransport
+    ------------------------------------------------
+    A MessageFocusTransport that passes requests through
+    to MessageFocus and appends each request / response
+    pair to a gzipped JSON lines file. Credentials only
+    ever appear in the host and are never written out.
+    Faults are recorded, transport errors are not.
+
+    >>> transport = RecordingTransport('traffic.jsonl.gz')
+    >>> client = MessageFocusClient(organisation, username, password,
+    ...                             transport=transport)
+    >>> ...
+    >>> transport.close_recording()
+    ------------------------------------------------
+    """
+
+    def __init__(self, path, *args, **kwargs):
+        MessageFocusTransport.__init__(self, *args, **kwargs)
+        self._recording = gzip.open(path, 'ab')
+        self._recording_lock = threading.Lock()
+        self._recording_started = None
+        return
+
+    def request(self, host, handler, request_body, verbose=False):
+        try:
+            result = MessageFocusTransport.request(self, host, handler, request_body, verbose)
+        except xmlrpclib.Fault as fault:
+            self._record(host, handler, request_body, xmlrpclib.dumps(fault, methodresponse=True))
+            raise
+        self._record(host, handler, request_body,
+                     xmlrpclib.dumps(result, methodresponse=True, allow_none=True))
+        return result
+
+    def _record(self, host, handler, request_body, response_body):
+        if isinstance(request_body, bytes):
+            request_body = request_body.decode('utf-8')
+        matches = METHOD_NAME.search(request_body)
+        now = time.time()
+        with self._recording_lock:
+            if self._recording_started is None:
+                self._recording_started = now
+            entry = {'t': round(now - self._recording_started, 6),
+                     'host': redact_host(host),
+                     'handler': handler,
+                     'method': matches.group(1) if matches else None,
+                     'request': request_body,
+                     'response': response_body}
+            line = json.dumps(entry, separators=(',', ':')) + '\n'
+            self._recording.write(line.encode('utf-8'))
+        return
+
+    def close_recording(self):
+        """
+        RecordingTransport.close_recording
+        ------------------------------------------------
+        Flush and close the recording file. Transport.close
+        is left alone as xmlrpclib uses it to drop stale
+        connections.
+        ------------------------------------------------
+        """
+        with self._recording_lock:
+            self._recording.close()
+        return
+
+
+class _ReplayRequestHandler(xmlrpcserver.SimpleXMLRPCRequestHandler):
+    # Accept any path, the client posts to /api/xmlrpc
+    rpc_paths = ()
+    # Keep connections alive so replays exercise the client's pool
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        return
+
+
+class ReplayServer(socketserver.ThreadingMixIn, xmlrpcserver.SimpleXMLRPCServer):
+    """
+    ReplayServer
+    ------------------------------------------------
+    A local threaded XML-RPC server standing in for
+    MessageFocus. Requests are answered with the
+    recorded response for an identical request body,
+    falling back to the last recorded response for the
+    same method name.
+
+    >>> server = ReplayServer('traffic.jsonl.gz')
+    >>> server.serve_in_background()
+    >>> client = MessageFocusClient('org', 'user', 'pass', url=server.url)
+    ------------------------------------------------
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, recording, host='127.0.0.1', port=0):
+        xmlrpcserver.SimpleXMLRPCServer.__init__(self, (host, port),
+                                                 requestHandler=_ReplayRequestHandler,
+                                                 logRequests=False,
+                                                 allow_none=True,
+                                                 encoding='UTF-8')
+        if not isinstance(recording, list):
+            recording = load_recording(recording)
+        self._responses = {}
+        self._method_responses = {}
+        for entry in recording:
+            response = entry['response'].encode('utf-8')
+            self._responses[entry['request'].encode('utf-8')] = response
+            self._method_responses[entry['method']] = response
+        return
+
+    @property
+    def url(self):
+        """
+        URL template suitable for MessageFocusClient(url=..)
+        """
+        return 'http://%%s.%%s:%%s@%s:%s/api/xmlrpc' % self.server_address[:2]
+
+    def serve_in_background(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        response = self._responses.get(data)
+        if response is None:
+            matches = METHOD_NAME.search(data.decode('utf-8', 'replace'))
+            response = self._method_responses.get(matches.group(1) if matches else None)
+        if response is None:
+            fault = xmlrpclib.Fault(-32601, 'Server error. Requested method not found.')
+            response = xmlrpclib.dumps(fault, methodresponse=True).encode('utf-8')
+        return response
+
+
+def replay(recording, url, clients=1, speed=1.0, trace_memory=False):
+    """
+    replay
+    ------------------------------------------------
+    Drive the recorded call sequence against url from
+    many concurrent clients, each running the whole
+    sequence. Calls keep their recorded spacing divided
+    by speed, a speed of 0 sends as fast as possible.
+    Returns a dict like {
+        'calls':   int,
+        'faults':  int,
+        'errors':  int,
+        'elapsed': float,
+        'calls_per_second': float,
+        'latency': {'mean': float, 'p50': float,
+                    'p95': float, 'max': float},
+        'peak_memory': int or None
+    }
+    ------------------------------------------------
+    @param  recording      str or list
+    @param  url            str, @see(ReplayServer.url)
+    @param  [clients]      int
+    @param  [speed]        float
+    @param  [trace_memory] bool
+    @return                dict
+    """
+    if not isinstance(recording, list):
+        recording = load_recording(recording)
+    calls = [(entry['t'],) + xmlrpclib.loads(entry['request'])[::-1] for entry in recording]
+
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+
+    lock = threading.Lock()
+    latencies = []
+    counts = {'faults': 0, 'errors': 0}
+    barrier = threading.Event()
+
+    def run():
+        api = MessageFocusClient('replay', 'replay', 'replay', url=url)._api
+        barrier.wait()
+        started = time.time()
+        for offset, method, params in calls:
+            if speed:
+                delay = started + offset / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            call_started = time.time()
+            outcome = None
+            try:
+                getattr(api, method)(*params)
+            except xmlrpclib.Fault:
+                outcome = 'faults'
+            except Exception:
+                outcome = 'errors'
+            elapsed = time.time() - call_started
+            with lock:
+                latencies.append(elapsed)
+                if outcome:
+                    counts[outcome] += 1
+        return
+
+    threads = [threading.Thread(target=run) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    started = time.time()
+    barrier.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    latencies.sort()
+
+    def percentile(p):
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    return {'calls': len(latencies),
+            'faults': counts['faults'],
+            'errors': counts['errors'],
+            'elapsed': elapsed,
+            'calls_per_second': len(latencies) / elapsed if elapsed else 0.0,
+            'latency': {'mean': sum(latencies) / len(latencies) if latencies else 0.0,
+                        'p50': percentile(0.5),
+                        'p95': percentile(0.95),
+                        'max': latencies[-1] if latencies else 0.0},
+            'peak_memory': peak_memory}
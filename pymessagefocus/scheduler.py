@@ -0,0 +1,208 @@
+from __future__ import absolute_import
+import collections
+import functools
+import threading
+import time
+
+from .tracing import phase
+
+
+# Priority scheduling of MessageFocusClient calls over a shared
+# concurrency budget. Each call takes a slot for its duration; when no
+# slot is free it queues in its priority class, and freed slots go to
+# the class that has had the least service relative to its weight
+# (weighted fair queuing), so bulk traffic keeps moving without
+# starving transactional sends.
+
+# Client methods not listed here run in the 'default' class.
+METHOD_PRIORITIES = {'transactional': 'transactional',
+                     'add_contact_to_list': 'bulk',
+                     'add_contacts_to_list': 'bulk',
+                     '_add_contact_to_core_table': 'bulk',
+                     '_associate_contact_with_list': 'bulk',
+                     'get_core_data_for_contact_ids': 'bulk',
+                     'get_lists_for_contact_ids': 'bulk',
+                     'get_lists': 'bulk',
+                     'get_core_tables': 'bulk',
+                     'get_data_tables': 'bulk'}
+
+DEFAULT_WEIGHTS = {'transactional': 8, 'default': 4, 'bulk': 1}
+
+_local = threading.local()
+
+
+class priority(object):
+    """
+    priority
+    ------------------------------------------------
+    Context manager overriding the priority class of
+    client calls made on this thread. Raises ValueError
+    on entry for a class the scheduler (or, without one,
+    DEFAULT_WEIGHTS) does not have.
+
+    >>> with priority('transactional'):
+    ...     messagefocus.get_core_data_for_email_address(1, email)
+    ------------------------------------------------
+    @param  priority_class str
+    @param  [scheduler]    Scheduler
+    """
+
+    def __init__(self, priority_class, scheduler=None):
+        self._priority_class = priority_class
+        self._classes = scheduler._weights if scheduler is not None else DEFAULT_WEIGHTS
+        self._previous = None
+        return
+
+    def __enter__(self):
+        if self._priority_class not in self._classes:
+            raise ValueError('Unknown priority class: %s' % self._priority_class)
+        self._previous = getattr(_local, 'override', None)
+        _local.override = self._priority_class
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.override = self._previous
+        return False
+
+
+class Scheduler(object):
+    """
+    Scheduler
+    ------------------------------------------------
+    Share a budget of concurrent calls between priority
+    classes by weight. A scheduler may be shared by
+    several clients to share one budget.
+    weights are merged over DEFAULT_WEIGHTS, so they may
+    change or add classes but every default class stays.
+    ------------------------------------------------
+    @param  [concurrency] int
+    @param  [weights]     dict {priority_class: int}
+    """
+
+    def __init__(self, concurrency=4, weights=None):
+        self._concurrency = concurrency
+        self._weights = dict(DEFAULT_WEIGHTS)
+        self._weights.update(weights or {})
+        for name, weight in self._weights.items():
+            if not weight > 0:
+                raise ValueError('Priority class weights must be positive: %s %s' % (name, weight))
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queues = dict((name, collections.deque()) for name in self._weights)
+        # Virtual finishing time per class and of the last dispatched call.
+        self._virtual = dict((name, 0.0) for name in self._weights)
+        self._clock = 0.0
+        self._stats = dict((name, {'calls': 0,
+                                   'queued': 0,
+                                   'max_queued': 0,
+                                   'wait_seconds': 0.0,
+                                   'max_wait_seconds': 0.0}) for name in self._weights)
+        return
+
+    def _dispatch(self):
+        # Called with the lock held.
+        while self._active < self._concurrency:
+            waiting = [name for name, queue in self._queues.items() if queue]
+            if not waiting:
+                return
+            name = min(waiting, key=lambda name: self._virtual[name])
+            self._clock = self._virtual[name]
+            self._virtual[name] += 1.0 / self._weights[name]
+            self._active += 1
+            self._queues[name].popleft().set()
+        return
+
+    def acquire(self, priority_class):
+        """
+        Scheduler.acquire
+        ------------------------------------------------
+        Block until a slot is granted to priority_class and
+        return the seconds spent waiting for it.
+        ------------------------------------------------
+        @param  priority_class str
+        @return                float
+        """
+        if priority_class not in self._weights:
+            raise ValueError('Unknown priority class: %s' % priority_class)
+        started = time.time()
+        granted = threading.Event()
+        with self._lock:
+            queue = self._queues[priority_class]
+            stats = self._stats[priority_class]
+            stats['calls'] += 1
+            if not queue:
+                # A class returning from idle starts at the current virtual
+                # time rather than spending credit it built up while idle.
+                self._virtual[priority_class] = max(self._virtual[priority_class], self._clock)
+            queue.append(granted)
+            stats['max_queued'] = max(stats['max_queued'], len(queue))
+            self._dispatch()
+        granted.wait()
+        waited = time.time() - started
+        with self._lock:
+            stats['wait_seconds'] += waited
+            stats['max_wait_seconds'] = max(stats['max_wait_seconds'], waited)
+        return waited
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            self._dispatch()
+        return
+
+    def stats(self):
+        """
+        Scheduler.stats
+        ------------------------------------------------
+        Return a dict like {
+            'concurrency': int,
+            'active':      int,
+            'classes': {priority_class: {
+                'calls':            int,
+                'queued':           int, current queue depth
+                'max_queued':       int,
+                'wait_seconds':     float, total
+                'max_wait_seconds': float
+            }}
+        }
+        ------------------------------------------------
+        @return dict
+        """
+        with self._lock:
+            classes = {}
+            for name, stats in self._stats.items():
+                classes[name] = dict(stats)
+                classes[name]['queued'] = len(self._queues[name])
+            return {'concurrency': self._concurrency,
+                    'active': self._active,
+                    'classes': classes}
+
+
+def scheduled(method):
+    """
+    scheduled
+    ------------------------------------------------
+    Decorator for MessageFocusClient methods taking a
+    slot from the client's scheduler, if it has one, for
+    the outermost call on this thread. The priority class
+    comes from a priority() override or METHOD_PRIORITIES.
+    Time spent queueing is traced as the 'queue' phase.
+    ------------------------------------------------
+    """
+    priority_class = METHOD_PRIORITIES.get(method.__name__, 'default')
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        scheduler = self._scheduler
+        if scheduler is None or getattr(_local, 'holding', False):
+            return method(self, *args, **kwargs)
+
+        with phase('queue'):
+            scheduler.acquire(getattr(_local, 'override', None) or priority_class)
+        _local.holding = True
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _local.holding = False
+            scheduler.release()
+    return wrapper
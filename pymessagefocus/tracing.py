@@ -0,0 +1,248 @@
+from __future__ import absolute_import
+import functools
+import io
+import threading
+import time
+
+try:
+    import cProfile
+    import pstats
+except ImportError:
+    cProfile = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# Per call tracing for MessageFocusClient. The outermost client method
+# call opens a span, everything it does on the same thread (including
+# nested client method calls) records timed phases into that span, and
+# the finished span is handed to the client's tracer callable.
+#
+# A span looks like {
+#     'name':     str,   client method name, e.g. 'transactional'
+#     'start':    float, epoch seconds
+#     'duration': float, seconds
+#     'success':  bool or None
+#     'phases':   [{'name': str, 'offset': float, 'duration': float}],
+#     'profile':  str or list, only on sampled calls
+# }
+#
+# Phase names are clean_contact_data, marshal, connect, send, wait,
+# unmarshal and parse_exception.
+
+timer = getattr(time, 'perf_counter', time.time)
+
+_local = threading.local()
+
+
+def current_span():
+    return getattr(_local, 'span', None)
+
+
+def record_phase(name, started, ended):
+    """
+    record_phase
+    ------------------------------------------------
+    Add a phase to the current span, if there is one.
+    ------------------------------------------------
+    @param  name    str
+    @param  started float, timer() value
+    @param  ended   float, timer() value
+    """
+    span = current_span()
+    if span is not None:
+        span['phases'].append({'name': name,
+                               'offset': started - span['_started'],
+                               'duration': ended - started})
+    return
+
+
+class phase(object):
+    """
+    phase
+    ------------------------------------------------
+    Context manager timing a named phase of the current
+    span. Does nothing when no span is open.
+    ------------------------------------------------
+    @param  name str
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._started = None
+        return
+
+    def __enter__(self):
+        if current_span() is not None:
+            self._started = timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._started is not None:
+            record_phase(self._name, self._started, timer())
+        return False
+
+
+def timed(name):
+    """
+    timed
+    ------------------------------------------------
+    Decorator timing every call of a method as a phase.
+    @see(phase)
+    ------------------------------------------------
+    @param  name str
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return method(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# cProfile (through sys.monitoring from Python 3.12) and tracemalloc
+# are process wide, so only one call is profiled at a time whichever
+# client or profiler it belongs to.
+_profiling_lock = threading.Lock()
+
+
+class SamplingProfiler(object):
+    """
+    SamplingProfiler
+    ------------------------------------------------
+    Profile one in every N traced calls with cProfile
+    (the top functions by cumulative time, as text) or
+    tracemalloc (the top allocation differences by line,
+    as a list of str) and attach the output to the span
+    as 'profile'.
+    Only one call in the process is profiled at a time,
+    a sampled call arriving meanwhile runs unprofiled.
+    tracemalloc cannot tell threads apart, so its output
+    covers allocations by every thread during the call.
+    Profiler failures are reported in 'profile' and never
+    affect the call itself.
+    ------------------------------------------------
+    @param  [mode]  str 'cprofile' or 'tracemalloc'
+    @param  [every] int
+    @param  [limit] int number of entries to report
+    """
+
+    def __init__(self, mode='cprofile', every=100, limit=20):
+        if mode == 'cprofile' and cProfile is None:
+            raise ValueError('cProfile is not available')
+        if mode == 'tracemalloc' and tracemalloc is None:
+            raise ValueError('tracemalloc is not available')
+        if mode not in ('cprofile', 'tracemalloc'):
+            raise ValueError('Unknown profiling mode: %s' % mode)
+        self._mode = mode
+        self._every = max(1, int(every))
+        self._limit = limit
+        self._calls = 0
+        self._lock = threading.Lock()
+        return
+
+    def sample(self):
+        with self._lock:
+            self._calls += 1
+            return not self._calls % self._every
+
+    def run(self, span, method, *args, **kwargs):
+        if not _profiling_lock.acquire(False):
+            return method(*args, **kwargs)
+        try:
+            if self._mode == 'cprofile':
+                return self._run_cprofile(span, method, *args, **kwargs)
+            return self._run_tracemalloc(span, method, *args, **kwargs)
+        finally:
+            _profiling_lock.release()
+
+    def _run_cprofile(self, span, method, *args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except Exception as e:
+            # e.g. another profiler is active on Python 3.12+
+            span['profile'] = 'Profiler unavailable: %s' % e
+            return method(*args, **kwargs)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            try:
+                profile.disable()
+                output = io.StringIO()
+                stats = pstats.Stats(profile, stream=output)
+                stats.sort_stats('cumulative').print_stats(self._limit)
+                span['profile'] = output.getvalue()
+            except Exception as e:
+                span['profile'] = 'Profiler failed: %s' % e
+
+    def _run_tracemalloc(self, span, method, *args, **kwargs):
+        started_tracing = False
+        try:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            before = tracemalloc.take_snapshot()
+        except Exception as e:
+            if started_tracing:
+                tracemalloc.stop()
+            span['profile'] = ['Profiler unavailable: %s' % e]
+            return method(*args, **kwargs)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            try:
+                after = tracemalloc.take_snapshot()
+                differences = after.compare_to(before, 'lineno')[:self._limit]
+                span['profile'] = [str(difference) for difference in differences]
+            except Exception as e:
+                span['profile'] = ['Profiler failed: %s' % e]
+            if started_tracing:
+                tracemalloc.stop()
+
+
+def traced(method):
+    """
+    traced
+    ------------------------------------------------
+    Decorator for MessageFocusClient methods opening a
+    span around the outermost call when the client has
+    a tracer, optionally profiling sampled calls.
+    Tracer errors are swallowed so tracing can never
+    fail an API call.
+    ------------------------------------------------
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        tracer = self._tracer
+        if tracer is None or current_span() is not None:
+            return method(self, *args, **kwargs)
+
+        span = {'name': method.__name__,
+                'start': time.time(),
+                'duration': None,
+                'success': None,
+                'phases': [],
+                '_started': timer()}
+        _local.span = span
+        try:
+            profiler = self._profiler
+            if profiler is not None and profiler.sample():
+                result = profiler.run(span, method, self, *args, **kwargs)
+            else:
+                result = method(self, *args, **kwargs)
+            if isinstance(result, dict):
+                span['success'] = result.get('success')
+            return result
+        finally:
+            _local.span = None
+            span['duration'] = timer() - span.pop('_started')
+            try:
+                tracer(span)
+            except Exception:
+                pass
+    return wrapper
@@ -0,0 +1,395 @@
+from __future__ import absolute_import
+import errno
+import http.client
+import socket
+import ssl
+import threading
+import time
+import xmlrpc.client as xmlrpclib
+
+from .tracing import phase, record_phase, timer
+
+
+class ServerProxy(xmlrpclib.ServerProxy):
+    """
+    ServerProxy
+    ------------------------------------------------
+    xmlrpclib.ServerProxy timing request marshalling as
+    the 'marshal' phase. @see(pymessagefocus.tracing)
+    Overrides the name mangled ServerProxy.__request and
+    so relies on its private attributes.
+    ------------------------------------------------
+    """
+
+    def _ServerProxy__request(self, methodname, params):
+        with phase('marshal'):
+            request = xmlrpclib.dumps(params, methodname,
+                                      encoding=self._ServerProxy__encoding,
+                                      allow_none=self._ServerProxy__allow_none)
+            request = request.encode(self._ServerProxy__encoding, 'xmlcharrefreplace')
+        response = self._ServerProxy__transport.request(self._ServerProxy__host,
+                                                        self._ServerProxy__handler,
+                                                        request,
+                                                        verbose=self._ServerProxy__verbose)
+        if len(response) == 1:
+            response = response[0]
+        return response
+
+    def warm_up(self, connections=1):
+        """
+        ServerProxy.warm_up
+        ------------------------------------------------
+        @see(MessageFocusTransport.warm_up)
+        ------------------------------------------------
+        """
+        return self._ServerProxy__transport.warm_up(self._ServerProxy__host, connections)
+
+
+class _HTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, transport, host, **kwargs):
+        http.client.HTTPConnection.__init__(self, host, **kwargs)
+        self._transport = transport
+        return
+
+    def connect(self):
+        self.sock = self._transport._open_socket(self)
+        return
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+
+    def __init__(self, transport, host, **kwargs):
+        http.client.HTTPSConnection.__init__(self, host, **kwargs)
+        self._transport = transport
+        return
+
+    def connect(self):
+        self.sock = self._transport._open_tls_socket(self, self._transport._open_socket(self))
+        return
+
+
+class MessageFocusTransport(xmlrpclib.SafeTransport):
+    """
+    MessageFocusTransport
+    ------------------------------------------------
+    The default MessageFocusClient transport.
+
+    Keeps a pool of idle keep-alive connections shared
+    by all threads, each request borrowing one for its
+    duration. Resolved addresses are cached for dns_ttl
+    seconds and new TLS connections resume the last TLS
+    session (session tickets) when the server allows it.
+    @see(MessageFocusTransport.connection_stats)
+
+    Times the 'connect', 'send', 'wait' (for the server)
+    and 'unmarshal' phases of each request.
+    @see(pymessagefocus.tracing)
+
+    Pass secure=False for plain http, e.g. when talking
+    to a local stand-in server.
+
+    idle_timeout should stay below the server's keep-alive
+    timeout (commonly 5 seconds or more). A request that
+    finds its pooled connection closed by the server all
+    the same drops the idle connections to that host and
+    is retried once on a new connection.
+    ------------------------------------------------
+    @param  [secure]       bool
+    @param  [dns_ttl]      float seconds
+    @param  [idle_timeout] float seconds an idle connection is kept
+    """
+
+    def __init__(self, secure=True, dns_ttl=300, idle_timeout=4, *args, **kwargs):
+        xmlrpclib.SafeTransport.__init__(self, *args, **kwargs)
+        self._secure = secure
+        self._dns_ttl = dns_ttl
+        self._idle_timeout = idle_timeout
+        if secure and self.context is None:
+            # A single context is needed for sessions to be resumable
+            # across connections.
+            self.context = ssl.create_default_context()
+            self.context.set_alpn_protocols(['http/1.1'])
+        self._timings = threading.local()
+        self._current = threading.local()
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._addresses = {}
+        self._session = None
+        self._stats = {'dns_lookups': 0,
+                       'connections': 0,
+                       'handshakes': 0,
+                       'resumed': 0,
+                       'handshake_seconds': 0.0,
+                       'max_handshake_seconds': 0.0}
+        return
+
+    def _resolve(self, host, port):
+        now = time.time()
+        with self._lock:
+            cached = self._addresses.get((host, port))
+        if cached and cached[0] > now:
+            return cached[1]
+        addresses = []
+        for family, socktype, proto, canonname, sockaddr in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+            if sockaddr[0] not in addresses:
+                addresses.append(sockaddr[0])
+        with self._lock:
+            self._addresses[(host, port)] = (now + self._dns_ttl, addresses)
+            self._stats['dns_lookups'] += 1
+        return addresses
+
+    def _open_socket(self, connection):
+        # Try every resolved address in turn, as socket.create_connection
+        # does, and move the one that answered to the front for next time.
+        key = (connection.host, connection.port)
+        addresses = self._resolve(connection.host, connection.port)
+        sock = None
+        error = None
+        for address in addresses:
+            try:
+                sock = socket.create_connection((address, connection.port),
+                                                connection.timeout,
+                                                connection.source_address)
+                break
+            except socket.error as e:
+                error = e
+        if sock is None:
+            # The cached addresses may have gone stale, resolve again next time.
+            with self._lock:
+                self._addresses.pop(key, None)
+            raise error or socket.error('No addresses found for %s' % connection.host)
+        if address != addresses[0]:
+            with self._lock:
+                cached = self._addresses.get(key)
+                if cached and address in cached[1]:
+                    self._addresses[key] = (cached[0], [address] + [other for other in cached[1] if other != address])
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except socket.error:
+            pass
+        with self._lock:
+            self._stats['connections'] += 1
+        return sock
+
+    def _open_tls_socket(self, connection, sock):
+        session = self._session
+        started = timer()
+        try:
+            sock = connection._context.wrap_socket(sock, server_hostname=connection.host, session=session)
+        except (ssl.SSLError, ValueError):
+            if session is None:
+                raise
+            # Fall back to a full handshake on a fresh socket if the
+            # session could not be used.
+            self._session = None
+            sock = connection._context.wrap_socket(self._open_socket(connection),
+                                                   server_hostname=connection.host)
+        elapsed = timer() - started
+        with self._lock:
+            self._stats['handshakes'] += 1
+            self._stats['resumed'] += int(sock.session_reused)
+            self._stats['handshake_seconds'] += elapsed
+            self._stats['max_handshake_seconds'] = max(self._stats['max_handshake_seconds'], elapsed)
+        self._keep_session(sock)
+        return sock
+
+    def _keep_session(self, sock):
+        # With TLS 1.3 the session ticket only arrives after the handshake,
+        # so this is also called whenever a connection goes back to the pool.
+        session = getattr(sock, 'session', None)
+        if session is not None and session.has_ticket:
+            self._session = session
+        return
+
+    def make_connection(self, host):
+        current = getattr(self._current, 'connection', None)
+        if current and current[0] == host:
+            return current[1]
+
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        connection = self._borrow(chost)
+        if connection is None:
+            connection = self._new_connection(chost, x509)
+        self._current.connection = host, connection
+
+        if connection.sock is None:
+            # Connect eagerly rather than on first send so that DNS,
+            # TCP and TLS time is reported on its own.
+            with phase('connect'):
+                connection.connect()
+        return connection
+
+    def _borrow(self, chost):
+        # Take the most recently used idle connection, closing any that
+        # have been idle long enough for the server to have dropped them.
+        now = time.time()
+        expired = []
+        connection = None
+        with self._lock:
+            idle = self._idle.get(chost, [])
+            while idle and connection is None:
+                candidate = idle.pop()
+                if candidate._idle_since + self._idle_timeout > now:
+                    connection = candidate
+                else:
+                    expired.append(candidate)
+        for candidate in expired:
+            candidate.close()
+        return connection
+
+    def _pool(self, connection):
+        connection._idle_since = time.time()
+        with self._lock:
+            self._idle.setdefault(connection._chost, []).append(connection)
+        return
+
+    def _new_connection(self, chost, x509=None):
+        if self._secure:
+            connection = _HTTPSConnection(self, chost, context=self.context, **(x509 or {}))
+        else:
+            connection = _HTTPConnection(self, chost)
+        connection._chost = chost
+        return connection
+
+    def request(self, host, handler, request_body, verbose=False):
+        # As xmlrpclib.Transport.request, except that the retry never
+        # borrows another pooled connection, which may be just as stale.
+        try:
+            for attempt in (0, 1):
+                try:
+                    return self.single_request(host, handler, request_body, verbose)
+                except (http.client.RemoteDisconnected, ssl.SSLEOFError):
+                    if attempt:
+                        raise
+                except OSError as e:
+                    if attempt or e.errno not in (errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE):
+                        raise
+                self._drop_idle(host)
+        finally:
+            self._release()
+
+    def _drop_idle(self, host):
+        # The server has closed a pooled connection, so the others it
+        # has been idle alongside are likely closed as well.
+        chost = self.get_host_info(host)[0]
+        with self._lock:
+            idle = self._idle.pop(chost, [])
+        for connection in idle:
+            connection.close()
+        return
+
+    def _release(self):
+        current = getattr(self._current, 'connection', None)
+        self._current.connection = None
+        if current is None or current[1].sock is None:
+            return
+        connection = current[1]
+        if self._secure:
+            self._keep_session(connection.sock)
+        self._pool(connection)
+        return
+
+    def close(self):
+        # xmlrpclib calls close() to drop a connection in a bad state,
+        # which here is the one borrowed by the calling thread.
+        current = getattr(self._current, 'connection', None)
+        self._current.connection = None
+        if current is not None:
+            current[1].close()
+        return
+
+    def close_idle(self):
+        """
+        MessageFocusTransport.close_idle
+        ------------------------------------------------
+        Close every pooled connection not currently in use.
+        ------------------------------------------------
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+        return
+
+    def warm_up(self, host, connections=1):
+        """
+        MessageFocusTransport.warm_up
+        ------------------------------------------------
+        Resolve host and open connections to it ahead of
+        the first request, topping the idle pool up to the
+        given number of connections. Returns the connection
+        stats. @see(MessageFocusTransport.connection_stats)
+        ------------------------------------------------
+        @param  host          str host descriptor as used by xmlrpclib
+        @param  [connections] int
+        @return               dict
+        """
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        with self._lock:
+            missing = connections - len(self._idle.get(chost, []))
+        for i in range(missing):
+            connection = self._new_connection(chost, x509)
+            connection.connect()
+            if self._secure and self._session is None:
+                self._read_session_ticket(connection.sock)
+            self._pool(connection)
+        return self.connection_stats()
+
+    def _read_session_ticket(self, sock):
+        # A short read lets the TLS layer process a TLS 1.3 session
+        # ticket, which the server may send a moment after the handshake
+        # completes on this side. An HTTP server sends nothing before a
+        # request so no data is lost.
+        timeout = sock.gettimeout()
+        sock.settimeout(0.05)
+        try:
+            sock.recv(1)
+        except (ssl.SSLWantReadError, socket.error):
+            pass
+        finally:
+            sock.settimeout(timeout)
+        self._keep_session(sock)
+        return
+
+    def connection_stats(self):
+        """
+        MessageFocusTransport.connection_stats
+        ------------------------------------------------
+        Return a dict like {
+            'dns_lookups':           int,
+            'connections':           int, opened so far
+            'handshakes':            int, TLS handshakes
+            'resumed':               int, handshakes resuming a session
+            'handshake_seconds':     float, total
+            'max_handshake_seconds': float,
+            'idle':                  int, pooled connections
+        }
+        ------------------------------------------------
+        @return dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = sum(len(connections) for connections in self._idle.values())
+        return stats
+
+    def send_request(self, host, handler, request_body, debug):
+        # Borrow (and if needed connect) the connection first so that its
+        # time is reported as 'connect' only and not again inside 'send'.
+        self.make_connection(host)
+        with phase('send'):
+            connection = xmlrpclib.SafeTransport.send_request(self, host, handler, request_body, debug)
+        self._timings.sent = timer()
+        return connection
+
+    def parse_response(self, response):
+        started = timer()
+        sent = getattr(self._timings, 'sent', None)
+        if sent is not None:
+            record_phase('wait', sent, started)
+            self._timings.sent = None
+        try:
+            return xmlrpclib.SafeTransport.parse_response(self, response)
+        finally:
+            record_phase('unmarshal', started, timer())
@@ -0,0 +1,46 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+from pymessagefocus.cache import MemoryCache, SQLiteCache
+
+
+class MemoryCacheTestCase(unittest.TestCase):
+
+    def cache(self):
+        return MemoryCache()
+
+    def test_get_set_delete(self):
+        cache = self.cache()
+        self.assertIsNone(cache.get('key'))
+        cache.set('key', {'success': True, 'results': [1]}, 60)
+        self.assertEqual(cache.get('key'), {'success': True, 'results': [1]})
+        cache.delete('key')
+        self.assertIsNone(cache.get('key'))
+
+    def test_expired(self):
+        cache = self.cache()
+        cache.set('key', 1, -1)
+        self.assertIsNone(cache.get('key'))
+
+    def test_values_are_not_shared(self):
+        cache = self.cache()
+        value = {'success': True, 'results': [1]}
+        cache.set('key', value, 60)
+        value['results'].append(2)
+        cache.get('key')['results'].append(3)
+        self.assertEqual(cache.get('key'), {'success': True, 'results': [1]})
+
+
+class SQLiteCacheTestCase(MemoryCacheTestCase):
+
+    def cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        return SQLiteCache(os.path.join(directory, 'cache.db'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+from __future__ import absolute_import
+import os
+import shutil
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+import xmlrpc.server as xmlrpcserver
+
+from pymessagefocus import MessageFocusClient
+from pymessagefocus.transport import MessageFocusTransport
+
+
+class _RequestHandler(xmlrpcserver.SimpleXMLRPCRequestHandler):
+    rpc_paths = ()
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        return
+
+
+class _Server(socketserver.ThreadingMixIn, xmlrpcserver.SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def serve(idle_timeout=None, context=None):
+    handler = type('RequestHandler', (_RequestHandler,), {'timeout': idle_timeout})
+    server = _Server(('127.0.0.1', 0), requestHandler=handler, logRequests=False, allow_none=True)
+    server.register_function(lambda: [{'id': 1, 'name': 'List'}], 'list.all')
+    if context is not None:
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class TransportTestCase(unittest.TestCase):
+
+    def client(self, server, transport=None, scheme='http', host='127.0.0.1'):
+        transport = transport or MessageFocusTransport(secure=scheme == 'https')
+        url = '%s://%%s.%%s:%%s@%s:%s/api/xmlrpc' % (scheme, host, server.server_address[1])
+        self.addCleanup(transport.close_idle)
+        return MessageFocusClient('organisation', 'username', 'password', transport=transport, url=url)
+
+    def test_stale_pooled_connections(self):
+        # The server drops idle connections after 1 second, before the pool does.
+        server = serve(idle_timeout=1)
+        self.addCleanup(server.shutdown)
+        client = self.client(server)
+        client.warm_up(3)
+        time.sleep(2)
+        result = client.get_lists()
+        self.assertEqual(result, {'success': True, 'results': [{'id': 1, 'name': 'List'}]})
+        self.assertEqual(client.connection_stats()['connections'], 4)
+
+    def test_idle_connections_expire(self):
+        server = serve()
+        self.addCleanup(server.shutdown)
+        client = self.client(server, transport=MessageFocusTransport(secure=False, idle_timeout=0.5))
+        client.warm_up(2)
+        time.sleep(1)
+        self.assertTrue(client.get_lists()['success'])
+        stats = client.connection_stats()
+        self.assertEqual((stats['connections'], stats['idle']), (3, 1))
+
+    def test_connections_shared_between_threads(self):
+        server = serve()
+        self.addCleanup(server.shutdown)
+        client = self.client(server)
+        results = []
+
+        def run():
+            for i in range(20):
+                results.append(client.get_lists()['success'])
+
+        threads = [threading.Thread(target=run) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * 160)
+        stats = client.connection_stats()
+        self.assertLessEqual(stats['connections'], 8)
+        self.assertEqual(stats['idle'], stats['connections'])
+
+
+@unittest.skipUnless(shutil.which('openssl'), 'openssl is needed to make a test certificate')
+class TLSTransportTestCase(TransportTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.certificate = os.path.join(directory, 'certificate.pem')
+        key = os.path.join(directory, 'key.pem')
+        subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                               '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost',
+                               '-keyout', key, '-out', self.certificate],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(self.certificate, key)
+        return
+
+    def client(self, server, transport=None, scheme='https', host='localhost'):
+        transport = transport or MessageFocusTransport()
+        transport.context.load_verify_locations(self.certificate)
+        return TransportTestCase.client(self, server, transport, scheme, host)
+
+    def test_stale_pooled_connections(self):
+        server = serve(idle_timeout=1, context=self.context)
+        self.addCleanup(server.shutdown)
+        client = self.client(server)
+        client.warm_up(3)
+        time.sleep(2)
+        self.assertTrue(client.get_lists()['success'])
+        stats = client.connection_stats()
+        self.assertEqual((stats['handshakes'], stats['resumed']), (4, 3))
+
+    def test_idle_connections_expire(self):
+        server = serve(context=self.context)
+        self.addCleanup(server.shutdown)
+        client = self.client(server, transport=MessageFocusTransport(idle_timeout=0.5))
+        client.warm_up(2)
+        time.sleep(1)
+        self.assertTrue(client.get_lists()['success'])
+        stats = client.connection_stats()
+        self.assertEqual((stats['handshakes'], stats['resumed']), (3, 2))
+
+    def test_connections_shared_between_threads(self):
+        server = serve(context=self.context)
+        self.addCleanup(server.shutdown)
+        client = self.client(server)
+        client.warm_up(1)
+        results = []
+
+        def run():
+            for i in range(20):
+                results.append(client.get_lists()['success'])
+
+        threads = [threading.Thread(target=run) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * 160)
+        stats = client.connection_stats()
+        self.assertLessEqual(stats['connections'], 8)
+        self.assertEqual(stats['resumed'], stats['handshakes'] - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()